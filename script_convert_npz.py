@@ -0,0 +1,21 @@
+import pathlib
+import numpy as np
+
+# Одноразовая конвертация результатов предобработки из старого формата
+# (.npy со словарем через pickle) в .npz, который читают script_work.py и script_rest_work.py
+path_result = pathlib.Path("data/result/")
+
+for npy_path in path_result.glob("*_processed.npy"):
+    npz_path = npy_path.with_suffix(".npz")
+    if npz_path.exists():
+        print(f"Уже сконвертирован: {npz_path.name}")
+        continue
+
+    data = np.load(npy_path, allow_pickle=True).item()
+    np.savez(
+        str(npz_path),
+        signals=np.array(data["signals"]),
+        labels=np.array(data["labels"]),
+        sampling_rate=data["sampling_rate"],
+    )
+    print(f"{npy_path.name} -> {npz_path.name}")
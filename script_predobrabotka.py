@@ -224,13 +224,11 @@ for file_name in file_names:
                 print("Added new calculated HR channel")
 
         # Сохраняем данные
-        np.save(
-            str(path_to_save / f"{file_name}_processed.npy"),
-            {
-                "signals": processed_signals,
-                "labels": ch_new,
-                "sampling_rate": samp_freq,
-            },
+        np.savez(
+            str(path_to_save / f"{file_name}_processed.npz"),
+            signals=np.array(processed_signals),
+            labels=np.array(ch_new),
+            sampling_rate=samp_freq,
         )
 
         # === ВИЗУАЛИЗАЦИЯ КАНАЛОВ (С ИНТЕРВАЛОМ) ===
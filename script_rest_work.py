@@ -1,20 +1,64 @@
+import os
 import pathlib
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+from numba import njit, prange
 from scipy.signal import find_peaks
 from scipy.stats import skew, kurtosis
 
 
 def load_data(file_path):
-    """Загрузка данных из .npy файла"""
-    data = np.load(file_path, allow_pickle=True).item()
-    return data["signals"], data["labels"], data["sampling_rate"]
+    """Загрузка данных из .npz файла"""
+    with np.load(file_path) as data:
+        return (
+            data["signals"],
+            data["labels"].tolist(),
+            data["sampling_rate"].item(),
+        )
 
 
-def normalize_data(signals):
-    """Z-нормализация для каждого канала"""
-    return [(channel - np.mean(channel)) / np.std(channel) for channel in signals]
+# Сигнатуры компилируются заранее (и берутся из кэша): C-непрерывный массив после
+# выбора каналов и произвольный срез, если анализируются все каналы
+@njit(
+    ["UniTuple(f8[:], 3)(f8[:, ::1])", "UniTuple(f8[:], 3)(f8[:, :])"],
+    parallel=True,
+    fastmath=True,
+    cache=True,
+)
+def reduce_interval(sig):
+    """Среднее, СКО и длина линии нормализованного сигнала за один проход по каждому каналу"""
+    n_channels, n_samples = sig.shape
+    mean = np.empty(n_channels)
+    std = np.empty(n_channels)
+    line_length = np.empty(n_channels)
+
+    for ch in prange(n_channels):
+        # Среднее и сумма квадратов отклонений по Уэлфорду, длина линии - по исходному сигналу
+        prev = sig[ch, 0]
+        m = prev
+        m2 = 0.0
+        ll = 0.0
+        for t in range(1, n_samples):
+            x = sig[ch, t]
+            delta = x - m
+            m += delta / (t + 1)
+            m2 += delta * (x - m)
+            ll += abs(x - prev)
+            prev = x
+
+        mean[ch] = m
+        std[ch] = np.sqrt(m2 / n_samples)
+        # Длина линии нормализованного сигнала (x - mean) / std равна ll / std
+        line_length[ch] = ll / std[ch]
+
+    return mean, std, line_length
+
+
+def normalize_data(signals, mean, std):
+    """Z-нормализация для каждого канала по заранее посчитанным среднему и СКО"""
+    return (signals - mean[:, None]) / std[:, None]
 
 
 def analyze_scr(signal, sr, peak_height=0.05, peak_prominence=0.03, min_distance=1.0):
@@ -41,11 +85,6 @@ def analyze_scr(signal, sr, peak_height=0.05, peak_prominence=0.03, min_distance
     return ns_scr, amp_scr, avg_recovery, peaks
 
 
-def calculate_line_length(signal):
-    """Вычисление длины линии как суммы абсолютных разностей между соседними точками"""
-    return np.sum(np.abs(np.diff(signal)))
-
-
 def plot_peaks(signal, peaks, filename, channel_name, sr, save_dir):
     """Сохранение графика с отмеченными пиками (только для SCR-каналов)"""
     plt.figure(figsize=(12, 4))
@@ -67,19 +106,20 @@ def plot_peaks(signal, peaks, filename, channel_name, sr, save_dir):
     plt.close()
 
 
-def process_file(file_path, start_sec, end_sec, selected_channels, save_dir):
-    """Обработка одного файла с сохранением графиков только для SCR-каналов"""
+def process_file(
+    file_path, data_future, start_sec, end_sec, selected_channels, save_dir
+):
+    """Обработка одного файла (data_future - фоновая загрузка load_data) с сохранением графиков только для SCR-каналов"""
     try:
-        data = np.load(file_path, allow_pickle=True).item()
-        signals = np.array(data["signals"])
-        labels = data["labels"]
-        sr = data["sampling_rate"]
+        signals, labels, sr = data_future.result()
 
-        # Обрезка временного интервала
+        # Обрезка временного интервала (срез - представление без копирования данных)
         start_idx = int(start_sec * sr)
         end_idx = int(end_sec * sr)
         if end_idx > signals.shape[1]:
             raise ValueError("Интервал анализа превышает длину сигнала")
+        if start_idx >= end_idx:
+            raise ValueError("Пустой интервал анализа")
         signals = signals[:, start_idx:end_idx]
 
         # Выбор каналов
@@ -90,14 +130,19 @@ def process_file(file_path, start_sec, end_sec, selected_channels, save_dir):
             signals = signals[channel_indices]
             labels = [labels[i] for i in channel_indices]
 
+        # Среднее, СКО и длина линии нормализованных сигналов за один проход
+        mean_values, std_values, line_lengths = reduce_interval(
+            np.asarray(signals, dtype=np.float64)
+        )
+
         # Нормализация
-        normalized = normalize_data(signals)
+        normalized = normalize_data(signals, mean_values, std_values)
 
         # Обработка для каждого канала
         results = []
         for i, (chan, label) in enumerate(zip(normalized, labels)):
             original_signal = signals[i]
-            line_length = calculate_line_length(chan)
+            line_length = line_lengths[i]
 
             # Определяем тип канала
             is_scr_channel = label in ["scr l", "scr r"]
@@ -113,7 +158,7 @@ def process_file(file_path, start_sec, end_sec, selected_channels, save_dir):
                 rmssd = np.sqrt(np.mean(diff_signal**2))
                 sk = skew(chan)
                 kurt_val = kurtosis(chan)
-                mean_val = np.mean(original_signal)
+                mean_val = mean_values[i]
                 fano = (
                     np.var(original_signal, ddof=1) / mean_val
                     if abs(mean_val) > 1e-7
@@ -121,7 +166,7 @@ def process_file(file_path, start_sec, end_sec, selected_channels, save_dir):
                 )
 
                 # Сохранение графика пиков
-                base_name = pathlib.Path(file_path).name.replace("_processed.npy", "")
+                base_name = pathlib.Path(file_path).name.replace("_processed.npz", "")
                 plot_peaks(chan, peaks, base_name, label, sr, save_dir)
             else:
                 # Только длина линии для не-SCR каналов
@@ -166,20 +211,35 @@ def main():
         "ppg r",
     ]
 
+    # Один проход по каталогу с проверкой суффикса вместо glob
+    with os.scandir(data_dir) as entries:
+        file_paths = [
+            pathlib.Path(entry.path)
+            for entry in entries
+            if entry.name.endswith("_processed.npz")
+        ]
+
     all_results = []
-    for file_path in data_dir.glob("*_processed.npy"):
-        metrics = process_file(
-            file_path, start_sec, end_sec, selected_channels, data_dir
-        )
+    # Следующий файл читается с диска в фоновом потоке, пока обрабатывается текущий
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        next_data = executor.submit(load_data, file_paths[0]) if file_paths else None
+        for k, file_path in enumerate(file_paths):
+            data_future = next_data
+            if k + 1 < len(file_paths):
+                next_data = executor.submit(load_data, file_paths[k + 1])
+
+            metrics = process_file(
+                file_path, data_future, start_sec, end_sec, selected_channels, data_dir
+            )
 
-        if metrics:
-            for chan_metrics in metrics:
-                all_results.append(
-                    {
-                        "File": file_path.name.replace("_processed.npy", ""),
-                        **chan_metrics,
-                    }
-                )
+            if metrics:
+                for chan_metrics in metrics:
+                    all_results.append(
+                        {
+                            "File": file_path.name.replace("_processed.npz", ""),
+                            **chan_metrics,
+                        }
+                    )
 
     # Сохранение результатов
     df = pd.DataFrame(all_results)
@@ -1,89 +1,166 @@
+import argparse
+import itertools
+import os
 import pathlib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 import numpy as np
 import pandas as pd
+import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
 import codecs
+import csv
+import io
 
 
 def load_data(file_path):
-    """Загрузка данных из .npy файла"""
-    data = np.load(file_path, allow_pickle=True).item()
-    return data["signals"], data["labels"], data["sampling_rate"]
-
-
-# Он считывает  файл, .npy, который у вас появился в папке Resulte после предобработки
-def normalize_features(df, feature_columns):
-    """Z-нормализация признаков"""
-    for col in feature_columns:
-        mean_val = df[col].mean()
-        std_val = df[col].std()
-        if std_val > 0:
-            df[col] = (df[col] - mean_val) / std_val
-        else:
-            df[col] = 0  # Обработка случая с нулевым стандартным отклонением
+    """Загрузка данных из .npz файла"""
+    with np.load(file_path) as data:
+        return (
+            data["signals"],
+            data["labels"].tolist(),
+            data["sampling_rate"].item(),
+        )
+
+
+# Он считывает  файл, .npz, который у вас появился в папке Resulte после предобработки
+def update_feature_stats(stats, df, feature_columns):
+    """Накопление количества, суммы и суммы квадратов признаков по очередной порции строк"""
+    values = df[feature_columns].to_numpy(dtype=np.float64)
+    valid = ~np.isnan(values)
+
+    if stats is None:
+        # Сдвиг на первое значение столбца защищает E[x^2] - E[x]^2 от потери точности
+        shift = values[valid.argmax(axis=0), np.arange(values.shape[1])]
+        n_cols = len(feature_columns)
+        stats = {
+            "n": np.zeros(n_cols),
+            "sum": np.zeros(n_cols),
+            "sum_sq": np.zeros(n_cols),
+            "shift": np.nan_to_num(shift),
+        }
+
+    x = np.where(valid, values - stats["shift"], 0.0)
+    stats["n"] += valid.sum(axis=0)
+    stats["sum"] += x.sum(axis=0)
+    stats["sum_sq"] += np.einsum("ij,ij->j", x, x)
+    return stats
+
+
+def normalize_features(df, feature_columns, stats):
+    """Z-нормализация признаков по статистике, накопленной update_feature_stats"""
+    features = df[feature_columns].to_numpy()
+    values = features.astype(np.float64)
+
+    # Среднее и СКО (ddof=1, как в pandas) из суммы и суммы квадратов
+    n, s = stats["n"], stats["sum"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = s / n
+        std = np.sqrt(np.maximum(stats["sum_sq"] - s * mean, 0.0) / (n - 1))
+        normalized = (values - stats["shift"] - mean) / std
+
+    normalized[:, ~(std > 0)] = 0  # Обработка случая с нулевым стандартным отклонением
+    df[feature_columns] = normalized.astype(features.dtype)
     return df
 
 
-def calculate_line_length(signal):
-    """Вычисление длины линии как суммы абсолютных разностей между соседними точками"""
-    return np.sum(np.abs(np.diff(signal)))
-
-
-def calculate_mean(signal):
-    """Вычисление среднего значения сигнала"""
-    return np.mean(signal)
+def _max_fields(raw):
+    """Максимальное число полей в строке лога (разделители - пробелы и табуляция)"""
+    data = np.frombuffer(raw, dtype=np.uint8)
+    is_break = (data == ord("\n")) | (data == ord("\r"))
+    is_sep = is_break | (data == ord(" ")) | (data == ord("\t"))
+    field_start = ~is_sep
+    field_start[1:] &= is_sep[:-1]
+    if not field_start.any():
+        return 0
+    return int(np.bincount(np.cumsum(is_break)[field_start]).max())
 
 
 def parse_log_file(log_path):
-    """Парсинг лог-файла с метками стимулов"""
-    intervals = []
-    current_start = None
-    current_label = None
+    """Парсинг лог-файла с метками стимулов в таблицу интервалов (label, start, end)"""
+    intervals = pd.DataFrame(columns=["label", "start", "end"])
+    # Имя лога в сообщениях: воркеры печатают их до заголовка файла в основном процессе
+    log_name = pathlib.Path(log_path).name
 
     try:
-        # Чтение файла с обработкой BOM
-        with codecs.open(log_path, "r", encoding="utf-8-sig") as f:
-            for line in f:
-                # Удаление BOM и лишних пробелов
-                line = line.strip().replace("\ufeff", "")
-                if not line:
-                    continue
-
-                # Разделение строки с учетом табуляции и пробелов
-                parts = line.split()
-                if len(parts) < 3:
-                    continue
-
-                try:
-                    # Обработка времени и маркера
-                    time = float(parts[0])
-                    marker = int(parts[2])
-
-                    # Обработка метки (может состоять из нескольких слов)
-                    label = " ".join(parts[3:]) if len(parts) > 3 else None
-
-                    if marker == 5:  # Начало стимула
-                        if current_start is not None:
-                            print(
-                                f"Предупреждение: незакрытый интервал для метки '{current_label}'"
-                            )
-                        current_start = time
-                        current_label = label
-                    elif marker == 6 and current_start is not None:  # Конец стимула
-                        intervals.append(
-                            {
-                                "label": current_label,
-                                "start": current_start,
-                                "end": time,
-                            }
-                        )
-                        current_start = None
-                        current_label = None
-                except (ValueError, IndexError) as e:
-                    print(f"Ошибка обработки строки: {line} - {str(e)}")
-                    continue
-
+        # Удаление BOM (в том числе в середине склеенных логов) сразу по всему файлу
+        raw = pathlib.Path(log_path).read_bytes().replace(codecs.BOM_UTF8, b"")
+        n_fields = _max_fields(raw)
+        if n_fields == 0:
+            return intervals
+
+        # Разделение строк с учетом табуляции и пробелов: время, _, маркер, метка.
+        # Столбцов столько, сколько полей в самой длинной строке, чтобы каждое слово
+        # метки попало в свой столбец; недостающие поля - пустые строки
+        parts = pd.read_csv(
+            io.BytesIO(raw),
+            sep=r"\s+",
+            header=None,
+            names=range(max(n_fields, 4)),
+            dtype=object,
+            na_filter=False,
+            quoting=csv.QUOTE_NONE,
+            encoding="utf-8",
+            engine="c",
+        )
+    except pd.errors.EmptyDataError:
+        return intervals
     except Exception as e:
         print(f"Ошибка чтения лог-файла {log_path}: {str(e)}")
+        return intervals
+
+    fields = parts[parts[2].ne("")]
+
+    # Обработка времени и маркера: astype у object-массива вызывает float()/int()
+    # для каждого значения, поэтому правила разбора те же, что и у построчного цикла.
+    # Время всегда float64, в том числе для логов только с целыми временами
+    try:
+        time = fields[0].to_numpy().astype(np.float64)
+        marker = fields[2].to_numpy().astype(np.int64)
+        parsed = np.ones(len(fields), dtype=bool)
+    except (ValueError, OverflowError):
+        # Есть некорректные строки - разбор по одной, чтобы сообщить о каждой
+        time = np.full(len(fields), np.nan)
+        marker = np.zeros(len(fields), dtype=np.int64)
+        parsed = np.ones(len(fields), dtype=bool)
+        for k, (time_str, marker_str) in enumerate(zip(fields[0], fields[2])):
+            try:
+                time[k] = float(time_str)
+                value = int(marker_str)
+                marker[k] = value if value in (5, 6) else 0  # важны только 5 и 6
+            except ValueError as e:
+                parsed[k] = False
+                row = fields.iloc[k]
+                line = " ".join(row[row.ne("")])
+                print(f"Ошибка обработки строки в {log_name}: {line} - {str(e)}")
+
+    events = pd.DataFrame({"time": time, "marker": marker}, index=fields.index)
+    events = events[parsed & events["marker"].isin([5, 6])]
+
+    # Обработка метки (может состоять из нескольких слов) только для нужных строк
+    label = parts.loc[events.index, 3]
+    for column in parts.columns[4:]:
+        word = parts.loc[events.index, column]
+        label = label.where(word.eq(""), label + " " + word)
+    events = events.assign(label=label.where(label.ne(""), None))
+
+    # Начало стимула (5) закрывается ближайшим следующим концом (6),
+    # повторное начало до конца перезаписывает незакрытый интервал
+    next_marker = events["marker"].shift(-1)
+    is_start = events["marker"].eq(5)
+    for current_label in events.loc[is_start & next_marker.eq(5), "label"]:
+        print(
+            f"Предупреждение: незакрытый интервал для метки '{current_label}' в {log_name}"
+        )
+
+    closed = is_start & next_marker.eq(6)
+    intervals = pd.DataFrame(
+        {
+            "label": events.loc[closed, "label"],
+            "start": events.loc[closed, "time"],
+            "end": events["time"].shift(-1)[closed],
+        }
+    ).reset_index(drop=True)
 
     return intervals
 
@@ -93,51 +170,75 @@ def process_file(file_path, log_path):
     try:
         # Загрузка данных полиграфа
         signals, labels, sr = load_data(file_path)
-        signals = np.array(signals)
+        # float32 (~7 значащих цифр) достаточно для физиологических сигналов и вдвое
+        # уменьшает объем данных; суммы по интервалам накапливаются в float64
+        signals = np.asarray(signals, dtype=np.float32)
 
         # Парсинг лог-файла
         intervals = parse_log_file(log_path)
-        if not intervals:
+        if intervals.empty:
             print(f"Не найдено интервалов в файле: {log_path}")
             return None
 
-        # Обработка каждого интервала
-        results = []
-        base_name = pathlib.Path(file_path).name.replace("_processed.npy", "")
-
-        for interval in intervals:
-            start_idx = int(interval["start"] * sr)
-            end_idx = int(interval["end"] * sr)
-
-            # Проверка корректности интервала
-            if start_idx < 0 or end_idx > signals.shape[1] or start_idx >= end_idx:
-                print(f"Некорректный интервал: {interval}")
-                continue
-
-            # Вырезаем интервал
-            interval_signals = signals[:, start_idx:end_idx]
-
-            # ВЫЧИСЛЕНИЕ ПАРАМЕТРОВ НА ИСХОДНЫХ СИГНАЛАХ (без нормализации)
-            line_lengths = [calculate_line_length(chan) for chan in interval_signals]
-            mean_values = [calculate_mean(chan) for chan in interval_signals]
-
-            # Собираем результаты
-            result = {
+        base_name = pathlib.Path(file_path).name.replace("_processed.npz", "")
+
+        # Границы всех интервалов в отсчетах
+        starts = (intervals["start"].to_numpy() * sr).astype(np.int64)
+        ends = (intervals["end"].to_numpy() * sr).astype(np.int64)
+
+        # Проверка корректности интервалов одной векторной маской; интервалы за пределами
+        # записи отбрасываются, а не обрезаются, чтобы не искажать признаки
+        valid = (starts >= 0) & (ends <= signals.shape[1]) & (starts < ends)
+        if not valid.all():
+            for k in np.flatnonzero(~valid):
+                print(
+                    f"Некорректный интервал в {base_name}: {intervals.iloc[k].to_dict()}"
+                )
+            intervals = intervals[valid]
+            starts, ends = starts[valid], ends[valid]
+            if intervals.empty:
+                return None
+
+        # ВЫЧИСЛЕНИЕ ПАРАМЕТРОВ НА ИСХОДНЫХ СИГНАЛАХ (без нормализации) сразу для всех интервалов.
+        # Префиксные суммы считаются один раз на файл (в float64), после чего сумма
+        # по любому интервалу [start, end) - разность двух элементов. Буфер сумм один
+        # на обе характеристики и заполняется по каналам, чтобы временные массивы
+        # не превышали одного канала
+        n_channels, n_samples = signals.shape
+        csum = np.zeros((n_channels, n_samples + 1))
+        for channel in range(n_channels):
+            np.cumsum(signals[channel], dtype=np.float64, out=csum[channel, 1:])
+        mean_values = (csum[:, ends] - csum[:, starts]) / (ends - starts)
+
+        # Длина линии - сумма абсолютных разностей между соседними точками интервала;
+        # после средних буфер переиспользуется: csum[:, k] - сумма первых k модулей разностей
+        for channel in range(n_channels):
+            diff = np.diff(signals[channel])
+            np.abs(diff, out=diff)
+            np.cumsum(diff, dtype=np.float64, out=csum[channel, 1:n_samples])
+        line_lengths = csum[:, ends - 1] - csum[:, starts]
+
+        # Собираем результаты
+        meta = pd.DataFrame(
+            {
                 "File": base_name,
-                "Label": interval["label"],
-                "Start_Time": interval["start"],
-                "End_Time": interval["end"],
-                "Duration": interval["end"] - interval["start"],
+                "Label": intervals["label"].to_numpy(),
+                "Start_Time": intervals["start"].to_numpy(),
+                "End_Time": intervals["end"].to_numpy(),
+                "Duration": (intervals["end"] - intervals["start"]).to_numpy(),
             }
+        )
+
+        # Характеристики всех каналов в одной предвыделенной матрице (интервалы x признаки),
+        # длина линии и среднее каждого канала идут парами
+        features = np.empty((len(intervals), 2 * len(labels)), dtype=np.float32)
+        features[:, 0::2] = line_lengths.T
+        features[:, 1::2] = mean_values.T
+        feature_cols = [
+            f"{label}_{name}" for label in labels for name in ("Line_Length", "Mean")
+        ]
 
-            # Добавляем характеристики для каждого канала
-            for i, label in enumerate(labels):
-                result[f"{label}_Line_Length"] = line_lengths[i]
-                result[f"{label}_Mean"] = mean_values[i]
-
-            results.append(result)
-
-        return results
+        return pd.concat([meta, pd.DataFrame(features, columns=feature_cols)], axis=1)
 
     except Exception as e:
         print(f"Ошибка обработки {file_path}: {str(e)}")
@@ -147,17 +248,46 @@ def process_file(file_path, log_path):
         return None
 
 
+def _worker(file_pair):
+    """Обработка пары (файл данных, лог-файл) в отдельном процессе"""
+    file_path, log_path = file_pair
+    return process_file(file_path, log_path)
+
+
 def main():
+    parser = argparse.ArgumentParser(
+        description="Расчет признаков сигналов по интервалам стимулов"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Количество процессов для параллельной обработки файлов",
+    )
+    parser.add_argument(
+        "--excel",
+        action="store_true",
+        help="Дополнительно сохранить результаты в .xlsx",
+    )
+    args = parser.parse_args()
+
     # Настройки путей
     data_dir = pathlib.Path("data/result/")
     log_dir = pathlib.Path("data/raw/")
 
-    # Сбор и обработка файлов
-    all_results = []
+    # Сбор файлов: один проход по каталогу с проверкой суффикса вместо glob
+    with os.scandir(data_dir) as entries:
+        data_paths = [
+            pathlib.Path(entry.path)
+            for entry in entries
+            if entry.name.endswith("_processed.npz")
+        ]
+
+    file_pairs = []
 
-    for file_path in data_dir.glob("*_processed.npy"):
+    for file_path in data_paths:
         # Формируем пути к файлам
-        base_name = file_path.name.replace("_processed.npy", "")
+        base_name = file_path.name.replace("_processed.npz", "")
         log_path = log_dir / f"{base_name}.txt"
 
         # Проверяем существование лог-файла
@@ -165,43 +295,131 @@ def main():
             print(f"Лог-файл не найден: {log_path}")
             continue
 
-        # Обрабатываем файл
-        print(f"Обработка файла: {file_path.name}")
-        file_results = process_file(file_path, log_path)
-        if file_results:
-            all_results.extend(file_results)
-            print(f"  Найдено интервалов: {len(file_results)}")
+        file_pairs.append((file_path, log_path))
+
+    # Файлы независимы, поэтому обрабатываем их параллельно в отдельных процессах.
+    # Результаты каждого файла дописываются в Parquet по мере готовности (в порядке
+    # завершения, а не запуска), а в памяти остаются только накопленные суммы для
+    # Z-нормализации
+    raw_path = data_dir / "Signal_Analysis_Results.parquet"
+    meta_cols = ["File", "Label", "Start_Time", "End_Time", "Duration"]
+
+    # Схема таблицы - объединение каналов всех файлов в порядке появления, чтобы
+    # признаки каналов, которых нет в первом файле, не терялись. Из .npz читается
+    # только массив labels, сигналы при этом не загружаются
+    channels = {}
+    for file_path, _ in file_pairs:
+        try:
+            with np.load(file_path) as data:
+                channels.update(dict.fromkeys(data["labels"].tolist()))
+        except Exception:
+            continue  # Ошибку чтения файла сообщит process_file
+    feature_cols = [
+        f"{label}_{name}" for label in channels for name in ("Line_Length", "Mean")
+    ]
+    columns = meta_cols + feature_cols
+    # Имена файлов и метки стимулов многократно повторяются, поэтому
+    # хранятся словарем и читаются обратно как категориальные столбцы
+    category = pa.dictionary(pa.int32(), pa.string())
+    schema = pa.schema(
+        [("File", category), ("Label", category)]
+        + [(col, pa.float64()) for col in meta_cols[2:]]
+        + [(col, pa.float32()) for col in feature_cols]
+    )
+    writer = None
+    stats = None
 
-    # Сохранение результатов
-    if all_results:
-        df = pd.DataFrame(all_results)
-
-        # Упорядочиваем столбцы
-        meta_cols = ["File", "Label", "Start_Time", "End_Time", "Duration"]
-        feature_cols = [col for col in df.columns if col not in meta_cols]
-        df = df[meta_cols + feature_cols]
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            # В очереди не больше двух файлов на процесс: готовые результаты не
+            # копятся в основном процессе, пока он записывает предыдущие
+            queued = iter(file_pairs)
+            pending = {}
+            for file_pair in itertools.islice(queued, 2 * (args.workers or 1)):
+                pending[executor.submit(_worker, file_pair)] = file_pair[0]
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    file_path = pending.pop(future)
+                    file_pair = next(queued, None)
+                    if file_pair is not None:
+                        pending[executor.submit(_worker, file_pair)] = file_pair[0]
+
+                    file_results = future.result()
+                    print(f"Обработка файла: {file_path.name}")
+                    if file_results is None:
+                        continue
+                    print(f"  Найдено интервалов: {len(file_results)}")
+
+                    if writer is None:
+                        writer = pq.ParquetWriter(raw_path, schema, compression="zstd")
+
+                    # Каналы, которых нет в этом файле, остаются пустыми (NaN)
+                    chunk = file_results.reindex(columns=columns)
+                    chunk[feature_cols] = chunk[feature_cols].astype("float32")
+
+                    writer.write_table(
+                        pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+                    )
+                    stats = update_feature_stats(stats, chunk, feature_cols)
+    finally:
+        if writer is not None:
+            writer.close()
 
-        # НОРМАЛИЗАЦИЯ ПРИЗНАКОВ ПОСЛЕ ВЫЧИСЛЕНИЯ
+    # Сохранение результатов
+    if writer is not None:
+        # НОРМАЛИЗАЦИЯ ПРИЗНАКОВ ПОСЛЕ ВЫЧИСЛЕНИЯ (второй проход по записанным группам строк)
         print("\nПрименение Z-нормализации к признакам...")
-        df = normalize_features(df, feature_cols)
+        output_path = data_dir / "Signal_Analysis_Results_Normalized.parquet"
+        raw_file = pq.ParquetFile(raw_path)
+        with pq.ParquetWriter(
+            output_path, raw_file.schema_arrow, compression="zstd"
+        ) as out:
+            for batch in raw_file.iter_batches():
+                chunk = normalize_features(batch.to_pandas(), feature_cols, stats)
+                out.write_table(
+                    pa.Table.from_pandas(
+                        chunk, schema=raw_file.schema_arrow, preserve_index=False
+                    )
+                )
 
-        # Сохранение результатов
-        output_path = data_dir / "Signal_Analysis_Results_Normalized.xlsx"
-        df.to_excel(str(output_path), index=False)
         print(f"\nРезультаты сохранены в: {output_path}")
-        print(f"Обработано файлов: {len(set(df['File']))}")
-        print(f"Обработано интервалов: {len(df)}")
-
-        # Краткая статистика
-        print("\nСтатистика по длине линии (после нормализации):")
-        line_cols = [col for col in df.columns if "Line_Length" in col]
-        print(df[line_cols].describe().transpose())
-
-        print("\nСтатистика по средним значениям (после нормализации):")
+        print(f"Признаки без нормализации: {raw_path}")
+        if args.excel:
+            df = pq.read_table(output_path).to_pandas()
+            excel_path = output_path.with_suffix(".xlsx")
+            df.to_excel(str(excel_path), index=False)
+            print(f"Копия для просмотра в Excel: {excel_path}")
+
+        # Статистика через Polars: ленивое чтение и многопоточные агрегаты по столбцам
+        results = pl.scan_parquet(output_path)
+        counts = results.select(
+            pl.col("File").n_unique().alias("files"), pl.len().alias("rows")
+        ).collect()
+        print(f"Обработано файлов: {counts['files'].item()}")
+        print(f"Обработано интервалов: {counts['rows'].item()}")
+
+        # Краткая статистика: строка на признак, как у describe().transpose() в pandas;
+        # без ограничений polars сократил бы таблицу до 10 строк и 8 столбцов
+        line_cols = [col for col in columns if "Line_Length" in col]
         mean_cols = [
-            col for col in df.columns if "_Mean" in col and "Line_Length" not in col
+            col for col in columns if "_Mean" in col and "Line_Length" not in col
         ]
-        print(df[mean_cols].describe().transpose())
+        with pl.Config(tbl_rows=-1, tbl_cols=-1):
+            print("\nСтатистика по длине линии (после нормализации):")
+            print(
+                results.select(line_cols)
+                .describe()
+                .transpose(include_header=True, column_names="statistic")
+            )
+
+            print("\nСтатистика по средним значениям (после нормализации):")
+            print(
+                results.select(mean_cols)
+                .describe()
+                .transpose(include_header=True, column_names="statistic")
+            )
     else:
         print("Нет данных для сохранения")
 